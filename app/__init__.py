@@ -10,7 +10,13 @@
 # The presence of this file allows you to import from the 'app' package 
 # in other parts of your project, e.g., 'from app import some_module'.
 
-from flask import Flask, session
+import hashlib
+import time
+import redis
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_migrate import Migrate
@@ -19,25 +25,79 @@ from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_principal import Principal, Permission, RoleNeed
 from flask_mail import Mail
-from flask_apscheduler import APScheduler
 from flask_uploads import configure_uploads, IMAGES, UploadSet
-from flask_swagger_ui import get_swaggerui_blueprint  # For API documentation
-from flask_socketio import SocketIO  # For real-time communication
-from flask_graphql import GraphQLView  # For GraphQL support
 from flask_session import Session  # For server-side session management
-from flask_cors import CORS  # For Cross-Origin Resource Sharing
+from flask_caching import Cache
+from celery import Celery
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import configure_mappers
 from config import Config
+from app.json_encoding import OrjsonEncoder, OrjsonDecoder
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
-# Enable CORS
-CORS(app)
+# jsonify, get_json and tojson use orjson (see app/json_encoding.py)
+app.json_encoder = OrjsonEncoder
+app.json_decoder = OrjsonDecoder
 
-# Enable server-side session management
+# CORS headers are the same for every response, so build them once
+_CORS_HEADERS = {
+    'Access-Control-Allow-Origin': app.config['CORS_ORIGIN'],
+    'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+}
+
+@app.after_request
+def add_cors_headers(response):
+    """
+    Attach the precomputed CORS headers to every response.
+    Vary is added to rather than replaced, so values set by the view
+    (such as Accept-Encoding on gzipped backups) are kept.
+    """
+    response.headers.update(_CORS_HEADERS)
+    response.vary.add('Origin')
+    return response
+
+# Shared Redis client (connections are opened lazily from its pool)
+redis_client = redis.Redis.from_url(
+    app.config['REDIS_URL'],
+    socket_timeout=app.config['REDIS_SOCKET_TIMEOUT'],
+    socket_connect_timeout=app.config['REDIS_SOCKET_TIMEOUT']
+)
+
+# Shared HTTP session for outbound API calls: keep-alive connections are reused
+# across requests, and idempotent calls retry briefly on connection errors
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=50,
+    max_retries=Retry(total=2, backoff_factor=0.1)
+))
+
+# Enable server-side session management, stored in Redis by default
+app.config.setdefault('SESSION_REDIS', redis_client)
 Session(app)
 
+# Shared cache for computed results (Redis by default, see CACHE_* in config.py)
+cache = Cache(app)
+
 db = SQLAlchemy(app)
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _log_slow_query(conn, cursor, statement, parameters, context, executemany):
+    """
+    Log statements that take longer than SLOW_QUERY_THRESHOLD seconds.
+    """
+    elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+    if elapsed > app.config['SLOW_QUERY_THRESHOLD']:
+        app.logger.warning('Slow query (%.3fs): %s', elapsed, statement)
+
 migrate = Migrate(app, db)
 login = LoginManager(app)
 login.login_view = 'login'
@@ -49,7 +109,7 @@ google = oauth.remote_app(
     'google',
     consumer_key=app.config['GOOGLE_CLIENT_ID'],
     consumer_secret=app.config['GOOGLE_CLIENT_SECRET'],
-    request_token_params={'scope': 'email'},
+    request_token_params={'scope': 'email', 'access_type': 'offline'},
     base_url='https://www.googleapis.com/oauth2/v1/',
     request_token_url=None,
     access_token_method='POST',
@@ -69,10 +129,16 @@ facebook = oauth.remote_app(
     authorize_url='https://www.facebook.com/dialog/oauth'
 )
 
-# Initialize rate limiter
+def get_hashed_remote_address():
+    """
+    Rate limit key derived from the client address, so raw IPs are never stored.
+    """
+    return hashlib.blake2s(get_remote_address().encode()).hexdigest()
+
+# Initialize rate limiter (Redis-backed, see RATELIMIT_* in config.py)
 limiter = Limiter(
     app,
-    key_func=get_remote_address,
+    key_func=get_hashed_remote_address,
     default_limits=["200 per day", "50 per hour"]
 )
 
@@ -86,39 +152,77 @@ user_permission = Permission(RoleNeed('user'))
 # Initialize Flask-Mail
 mail = Mail(app)
 
-# Initialize APScheduler for scheduled tasks
-scheduler = APScheduler()
-scheduler.init_app(app)
-scheduler.start()
+# Celery for work that should not block a request (run: celery -A app.celery worker)
+celery = Celery(app.import_name, broker=app.config['CELERY_BROKER_URL'])
+celery.conf.update(task_ignore_result=True, task_always_eager=app.config['CELERY_TASK_ALWAYS_EAGER'])
 
 # Configure image uploads
 photos = UploadSet('photos', IMAGES)
 configure_uploads(app, photos)
 
-# Swagger configuration for API documentation
-SWAGGER_URL = '/api/docs'
-API_URL = '/static/swagger.json'
-swaggerui_blueprint = get_swaggerui_blueprint(SWAGGER_URL, API_URL, config={'app_name': "Personal Finance Management System"})
-app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
+# Optional extensions are imported only when enabled (see ENABLE_* in config.py),
+# so CLI commands and health-check workers skip their import and start-up cost.
+scheduler = None
+socketio = None
 
-# Initialize SocketIO
-socketio = SocketIO(app)
+# Initialize APScheduler for scheduled tasks
+if app.config['ENABLE_SCHEDULER']:
+    from flask_apscheduler import APScheduler
+    scheduler = APScheduler()
+    scheduler.init_app(app)
 
-# Register GraphQL view
-from app.graphql_schema import schema
-app.add_url_rule('/graphql', view_func=GraphQLView.as_view('graphql', schema=schema, graphiql=True))
+# Swagger configuration for API documentation
+if app.config['ENABLE_API_DOCS']:
+    from flask_swagger_ui import get_swaggerui_blueprint
+    SWAGGER_URL = '/api/docs'
+    API_URL = '/static/swagger.json'
+    swaggerui_blueprint = get_swaggerui_blueprint(SWAGGER_URL, API_URL, config={'app_name': "Personal Finance Management System"})
+    app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
+
+# Initialize SocketIO for real-time communication
+if app.config['ENABLE_SOCKETIO']:
+    from flask_socketio import SocketIO
+    socketio = SocketIO(app)
 
-from app import routes, models, socketio_events
+# Register GraphQL view
+if app.config['ENABLE_GRAPHQL']:
+    from flask_graphql import GraphQLView
+    from app.graphql_schema import schema
+    app.add_url_rule('/graphql', view_func=GraphQLView.as_view('graphql', schema=schema, graphiql=True))
 
-@login.user_loader
-def load_user(id):
+def start_background_services():
+    """
+    Start the per-process background threads (the activity log writer) and,
+    with SQLALCHEMY_WARM_POOL, open one pooled connection so the first request
+    skips the handshake. Neither threads nor database connections may cross
+    a fork, so under `gunicorn --preload` this runs from the post_fork hook in
+    gunicorn.conf.py instead of at import time.
+    """
+    from app.activity_logger import start_activity_writer
+    start_activity_writer()
+    if app.config['SQLALCHEMY_WARM_POOL']:
+        with app.app_context():
+            db.session.execute(text('SELECT 1'))
+            db.session.remove()
+
+def start_scheduler():
     """
-    Load user by ID for Flask-Login.
+    Start the scheduled jobs. Jobs must fire once, not once per worker, so
+    this runs in a single process: clock.py in production, or at import
+    time when RUN_SCHEDULER is set (e.g. for the development server).
     """
-    return User.query.get(int(id))
+    if scheduler is not None and not scheduler.running:
+        scheduler.start()
+
+from app import routes, models, tasks
+
+# Configure all mappers now rather than on the first query of each worker
+configure_mappers()
+
+if not app.config['DEFER_BACKGROUND_START']:
+    start_background_services()
+    if app.config['RUN_SCHEDULER']:
+        start_scheduler()
 
-# Session timeout configuration
-@app.before_request
-def make_session_permanent():
-    session.permanent = True
-    app.permanent_session_lifetime = timedelta(minutes=30)
+if socketio is not None:
+    from app import socketio_events
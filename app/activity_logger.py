@@ -0,0 +1,106 @@
+# app/activity_logger.py
+
+"""
+Buffered writer for ActivityLog rows.
+
+log_activity() only enqueues the entry. A background thread drains the queue
+and inserts the rows in batches with one commit per batch, so request handlers
+no longer pay an INSERT + COMMIT for every logged action.
+"""
+
+import atexit
+import queue
+import threading
+import time
+from datetime import datetime
+from sqlalchemy.exc import InterfaceError, OperationalError, SQLAlchemyError
+from app import app, db
+from app.models import ActivityLog
+
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0  # Seconds to wait for more entries before writing a partial batch
+
+_queue = queue.Queue(maxsize=10000)
+_writer = None
+
+def log_activity(user_id, action):
+    """
+    Log user activity.
+    """
+    entry = {'user_id': user_id, 'action': action, 'timestamp': datetime.utcnow()}
+    try:
+        _queue.put_nowait(entry)
+    except queue.Full:
+        # The writer has fallen behind; write synchronously rather than drop the entry
+        write_batch([entry])
+
+def write_batch(entries):
+    """
+    Insert a batch of activity entries with a single executemany and commit.
+    Uses its own connection so it never commits a request's ORM session.
+    A batch the database rejects is split in half and each half retried, so
+    one bad entry (say, for an account deleted in the meantime) is logged and
+    dropped on its own instead of taking the whole batch with it.
+    """
+    try:
+        with app.app_context():
+            with db.engine.begin() as connection:
+                connection.execute(ActivityLog.__table__.insert(), entries)
+    except (OperationalError, InterfaceError):
+        raise  # The database is unreachable; splitting the batch would not help
+    except SQLAlchemyError:
+        if len(entries) == 1:
+            app.logger.exception('Dropped activity log entry %r', entries[0])
+            return
+        middle = len(entries) // 2
+        write_batch(entries[:middle])
+        write_batch(entries[middle:])
+
+def _next_batch():
+    """
+    Block until an entry arrives, then collect up to BATCH_SIZE entries
+    or whatever arrives within FLUSH_INTERVAL.
+    """
+    batch = [_queue.get()]
+    deadline = time.monotonic() + FLUSH_INTERVAL
+    while len(batch) < BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+def _run():
+    while True:
+        batch = _next_batch()
+        try:
+            write_batch(batch)
+        except Exception:
+            app.logger.exception('Failed to write %d activity log entries', len(batch))
+
+def flush_pending():
+    """
+    Write everything still queued. Registered to run at interpreter exit.
+    """
+    batch = []
+    while True:
+        try:
+            batch.append(_queue.get_nowait())
+        except queue.Empty:
+            break
+    if batch:
+        write_batch(batch)
+
+def start_activity_writer():
+    """
+    Start the background writer thread if it is not already running.
+    """
+    global _writer
+    if _writer is None or not _writer.is_alive():
+        _writer = threading.Thread(target=_run, name='activity-log-writer', daemon=True)
+        _writer.start()
+
+atexit.register(flush_pending)
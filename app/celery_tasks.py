@@ -0,0 +1,99 @@
+# app/celery_tasks.py
+
+"""
+Celery tasks for work that should not run on the request thread.
+
+Tasks:
+    - send_email_task: Sends an HTML email through Flask-Mail, retrying on SMTP failures.
+    - import_plaid_transactions_task: Fetches a user's Plaid transactions and stores them.
+    - resize_profile_picture_task: Shrinks an uploaded profile picture in place.
+
+Start a worker with: celery -A app.celery worker
+The worker must see the same upload folders as the web processes.
+"""
+
+import os
+from celery.signals import worker_process_init
+from flask_mail import Message
+from app import app, celery, cache, db, mail, start_background_services
+from app.plaid_utils import get_transactions, ingest_plaid_transactions
+
+@worker_process_init.connect
+def _start_worker_services(**kwargs):
+    """
+    Start the activity log writer in each forked pool process; threads
+    started when the worker imported the app only live in its parent, and
+    connections it pooled stay with it.
+    """
+    db.engine.dispose(close=False)
+    start_background_services()
+
+@celery.task(bind=True, max_retries=3, default_retry_delay=30, rate_limit='10/m')
+def send_email_task(self, to, subject, html):
+    """
+    Send an email. Rate limited per worker to smooth bursts that would
+    otherwise trip the mail provider's throttling.
+    """
+    with app.app_context():
+        msg = Message(
+            subject,
+            recipients=[to],
+            html=html,
+            sender=app.config['MAIL_DEFAULT_SENDER']
+        )
+        try:
+            mail.send(msg)
+        except Exception as exc:
+            raise self.retry(exc=exc)
+
+@celery.task(bind=True, max_retries=3, default_retry_delay=60)
+def import_plaid_transactions_task(self, user_id, access_token, start_date, end_date):
+    """
+    Import a user's Plaid transactions for a period. Plaid's transactions
+    endpoint is slow, so this runs on the worker instead of the request.
+    """
+    from app.routes import monthly_spending  # Deferred: app.routes imports this module
+    with app.app_context():
+        try:
+            transactions = get_transactions(access_token, start_date, end_date)
+        except Exception as exc:
+            raise self.retry(exc=exc)
+        try:
+            ingest_plaid_transactions(user_id, transactions)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        cache.delete_memoized(monthly_spending, user_id)
+
+# Square bounding box, in pixels, that stored profile pictures are shrunk to
+PROFILE_PICTURE_SIZE = 512
+
+@celery.task
+def resize_profile_picture_task(path):
+    """
+    Shrink an uploaded profile picture in place to at most
+    PROFILE_PICTURE_SIZE pixels a side, keeping its file name and format,
+    so wherever the picture is shown the small version is served.
+    """
+    from PIL import Image, UnidentifiedImageError  # Deferred: only the worker resizes images
+    try:
+        img = Image.open(path)
+    except UnidentifiedImageError:
+        app.logger.warning('Profile picture %s is not a readable image', path)
+        return
+    resized = f'{path}.resized'
+    with img:
+        if max(img.size) <= PROFILE_PICTURE_SIZE:
+            return
+        image_format = img.format
+        # JPEGs decode straight at a reduced scale; other formats ignore this
+        img.draft('RGB', (PROFILE_PICTURE_SIZE, PROFILE_PICTURE_SIZE))
+        img.thumbnail((PROFILE_PICTURE_SIZE, PROFILE_PICTURE_SIZE))
+        try:
+            img.save(resized, image_format)
+        except Exception:
+            if os.path.exists(resized):
+                os.remove(resized)
+            raise
+    os.replace(resized, path)
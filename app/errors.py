@@ -15,8 +15,10 @@ def not_found_error(error):
 def internal_error(error):
     """
     Custom handler for 500 (Internal Server Error) errors.
-    Rolls back the database session to prevent invalid states
-    and renders a custom 500 error page.
+    Rolls back the database session, if a transaction is open, to prevent
+    invalid states and renders a custom 500 error page.
     """
-    db.session.rollback()
+    session = db.session()
+    if session.in_transaction():
+        session.rollback()
     return render_template('500.html'), 500
\ No newline at end of file
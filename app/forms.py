@@ -1,17 +1,41 @@
 # app/forms.py
 
+import re
+from datetime import datetime
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, BooleanField, SubmitField, SelectField, FloatField, DateTimeField, FileField, TextAreaField, SelectMultipleField
+from flask_wtf.file import FileField, FileRequired, FileAllowed
+from wtforms import StringField, PasswordField, BooleanField, SubmitField, SelectField, FloatField, DateTimeField, TextAreaField, SelectMultipleField
 from wtforms.validators import DataRequired, ValidationError, Email, EqualTo
+from app import db, photos
 from app.models import User
-from password_strength import PasswordPolicy
 
-policy = PasswordPolicy.from_names(
-    length=8,
-    uppercase=1,
-    numbers=1,
-    special=1,
-)
+# At least 8 characters with one uppercase letter, one number and one special character
+PASSWORD_RE = re.compile(r'^(?=.*[A-Z])(?=.*\d)(?=.*[^A-Za-z0-9]).{8,}$', re.DOTALL)
+
+class ISODateTimeField(DateTimeField):
+    """
+    DateTimeField that parses ISO-8601 input with datetime.fromisoformat,
+    which is implemented in C and much cheaper than strptime. It renders as a
+    datetime-local input, so browsers submit ISO-8601 natively, and still
+    accepts the 'YYYY-MM-DD HH:MM:SS' form used previously.
+    """
+    def __init__(self, label=None, validators=None, **kwargs):
+        kwargs.setdefault('render_kw', {'type': 'datetime-local'})
+        super().__init__(label, validators, **kwargs)
+
+    def _value(self):
+        if self.raw_data:
+            return ' '.join(self.raw_data)
+        return self.data.isoformat(timespec='minutes') if self.data else ''
+
+    def process_formdata(self, valuelist):
+        if not valuelist:
+            return
+        try:
+            self.data = datetime.fromisoformat(' '.join(valuelist).strip())
+        except ValueError:
+            self.data = None
+            raise ValueError(self.gettext('Not a valid datetime value.'))
 
 class LoginForm(FlaskForm):
     """
@@ -33,28 +57,29 @@ class RegistrationForm(FlaskForm):
         'Repeat Password', validators=[DataRequired(), EqualTo('password')])
     submit = SubmitField('Register')
 
-    def validate_username(self, username):
-        """
-        Validate that the username is not already in use.
-        """
-        user = User.query.filter_by(username=username.data).first()
-        if user is not None:
-            raise ValidationError('Please use a different username.')
-
-    def validate_email(self, email):
+    def validate(self, *args, **kwargs):
         """
-        Validate that the email is not already in use.
+        Validate the fields, then check that the username and email are not
+        already in use with a single query.
         """
-        user = User.query.filter_by(email=email.data).first()
-        if user is not None:
-            raise ValidationError('Please use a different email address.')
+        valid = super().validate(*args, **kwargs)
+        taken = db.session.query(User.username, User.email).filter(
+            db.or_(User.username == self.username.data, User.email == self.email.data)
+        ).limit(2).all()
+        for username, email in taken:
+            if username == self.username.data:
+                self.username.errors.append('Please use a different username.')
+                valid = False
+            if email == self.email.data:
+                self.email.errors.append('Please use a different email address.')
+                valid = False
+        return valid
 
     def validate_password(self, password):
         """
         Validate that the password meets the strength requirements.
         """
-        errors = policy.test(password.data)
-        if errors:
+        if not PASSWORD_RE.match(password.data):
             raise ValidationError('Password must be at least 8 characters long and include one uppercase letter, one number, and one special character.')
 
 class ProfileForm(FlaskForm):
@@ -96,15 +121,15 @@ class RecurringTransactionForm(FlaskForm):
     amount = FloatField('Amount', validators=[DataRequired()])
     category = StringField('Category', validators=[DataRequired()])
     interval = SelectField('Interval', choices=[('daily', 'Daily'), ('weekly', 'Weekly'), ('monthly', 'Monthly')], validators=[DataRequired()])
-    next_date = DateTimeField('Next Date', format='%Y-%m-%d %H:%M:%S', validators=[DataRequired()])
+    next_date = ISODateTimeField('Next Date', validators=[DataRequired()])
     submit = SubmitField('Add Recurring Transaction')
 
 class SearchForm(FlaskForm):
     """
     Form for advanced search and filtering of transactions.
     """
-    start_date = DateTimeField('Start Date', format='%Y-%m-%d %H:%M:%S', validators=[DataRequired()])
-    end_date = DateTimeField('End Date', format='%Y-%m-%d %H:%M:%S', validators=[DataRequired()])
+    start_date = ISODateTimeField('Start Date', validators=[DataRequired()])
+    end_date = ISODateTimeField('End Date', validators=[DataRequired()])
     category = StringField('Category')
     submit = SubmitField('Search')
 
@@ -120,7 +145,7 @@ class TransactionForm(FlaskForm):
     """
     Form for uploading transaction receipt.
     """
-    receipt = FileField('Receipt', validators=[DataRequired()])
+    receipt = FileField('Receipt', validators=[FileRequired()])
     submit = SubmitField('Upload Receipt')
 
 class BackupForm(FlaskForm):
@@ -133,7 +158,7 @@ class RestoreForm(FlaskForm):
     """
     Form for restoring user data.
     """
-    backup_file = FileField('Backup File', validators=[DataRequired()])
+    backup_file = FileField('Backup File', validators=[FileRequired(), FileAllowed(['json'], 'JSON backups only!')])
     submit = SubmitField('Restore Data')
 
 class CategorizeTransactionForm(FlaskForm):
@@ -192,5 +217,5 @@ class UploadProfilePictureForm(FlaskForm):
     """
     Form for uploading profile picture.
     """
-    photo = FileField('Profile Picture', validators=[DataRequired()])
+    photo = FileField('Profile Picture', validators=[FileRequired(), FileAllowed(photos, 'Images only!')])
     submit = SubmitField('Upload')
@@ -19,10 +19,13 @@ class Query(ObjectType):
 
     # Resolver function for the 'user' field
     def resolve_user(self, info):
+        # Resolve the proxy once; Flask-Login loads the user at most once per
+        # request, through load_user's per-request and Redis caches
+        user = current_user._get_current_object()
         # Check if the user is authenticated
-        if current_user.is_authenticated:
+        if user.is_authenticated:
             # If authenticated, return a greeting with the username
-            return f'Hello {current_user.username}!'
+            return f'Hello {user.username}!'
         # If not authenticated, return a generic greeting
         return 'Hello Guest!'
 
@@ -1,9 +1,27 @@
 # app/models.py
 
 from datetime import datetime
-from app import db, login
+from functools import lru_cache
+import redis
+from flask import g
+from app import app, db, login, cache
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, select
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Session, make_transient_to_detached, object_session
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHash
+
+# argon2id hasher; tune the ARGON2_* costs in config.py to the login latency budget
+password_hasher = PasswordHasher(
+    time_cost=app.config['ARGON2_TIME_COST'],
+    memory_cost=app.config['ARGON2_MEMORY_COST'],
+    parallelism=app.config['ARGON2_PARALLELISM']
+)
+
+# Binary JSON on PostgreSQL: stored pre-parsed and indexable; plain JSON elsewhere
+SETTINGS_JSON = db.JSON().with_variant(JSONB(), 'postgresql')
 
 class User(UserMixin, db.Model):
     """
@@ -12,40 +30,199 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True)
     email = db.Column(db.String(120), index=True, unique=True)
-    password_hash = db.Column(db.String(128))
+    # Credentials are deferred: they are never loaded by, or cached with,
+    # current_user, and are fetched together only where they are used
+    password_hash = db.deferred(db.Column(db.String(128)), group='secrets')
     two_factor_enabled = db.Column(db.Boolean, default=False)
-    two_factor_secret = db.Column(db.String(32))
+    two_factor_secret = db.deferred(db.Column(db.String(32)), group='secrets')
     email_verified = db.Column(db.Boolean, default=False)
     currency = db.Column(db.String(3), default='USD')
-    dashboard_config = db.Column(db.Text)
-    notification_preferences = db.Column(db.Text)
+    dashboard_config = db.Column(SETTINGS_JSON)  # Decoded by SQLAlchemy on load
+    notification_preferences = db.Column(SETTINGS_JSON)
     profile_picture = db.Column(db.String(255))  # New field for storing profile picture filename
+    oauth_provider = db.Column(db.String(16))
+    oauth_access_token = db.deferred(db.Column(db.String(2048)), group='secrets')
+    oauth_refresh_token = db.deferred(db.Column(db.String(512)), group='secrets')
+    oauth_expires_at = db.Column(db.DateTime, index=True)
     roles = db.relationship('Role', secondary='user_roles')
     notifications = db.relationship('UserNotification', backref='user', lazy='dynamic')
+    transactions = db.relationship('Transaction', back_populates='user')
+    recurring_transactions = db.relationship('RecurringTransaction', back_populates='user')
+    activity_logs = db.relationship('ActivityLog', back_populates='user')
 
     def set_password(self, password):
         """
         Set password for the user.
         """
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
         """
         Check if the provided password matches the stored password hash.
+        Legacy Werkzeug hashes, and argon2 hashes made with outdated costs,
+        are upgraded in place after a successful check.
         """
-        return check_password_hash(self.password_hash, password)
+        if self.password_hash is None:
+            return False
+        if not self.password_hash.startswith('$argon2'):
+            if not check_password_hash(self.password_hash, password):
+                return False
+            self.set_password(password)
+            return True
+        try:
+            password_hasher.verify(self.password_hash, password)
+        except (VerificationError, InvalidHash):
+            return False
+        if password_hasher.check_needs_rehash(self.password_hash):
+            self.set_password(password)
+        return True
+
+@lru_cache(maxsize=1)
+def _dummy_password_hash():
+    """
+    Hash checked against when a login names an unknown user.
+    """
+    return password_hasher.hash('dummy-password-for-timing')
+
+def check_login(user, password):
+    """
+    Check a login attempt. Unknown users are verified against a dummy hash,
+    so the response time does not reveal whether the username exists;
+    argon2 itself compares digests in constant time.
+    """
+    if user is None:
+        try:
+            password_hasher.verify(_dummy_password_hash(), password)
+        except VerificationError:
+            pass
+        return False
+    return user.check_password(password)
+
+# Column values of recently loaded users, kept in the shared cache so every
+# worker can skip the SELECT. There is deliberately no per-process layer: an
+# update or delete drops the one shared entry, so no worker keeps serving a
+# deleted account or an outdated 2FA setting after the commit.
+USER_CACHE_TIMEOUT = 300
+
+# Only the columns current_user loads are cached; the deferred credentials
+# (the 'secrets' group) never reach a cache. Read from the table rather than
+# the mapper, so importing this module does not configure the mappers before
+# Role and UserRoles below are defined.
+USER_SECRET_COLUMNS = ('password_hash', 'two_factor_secret', 'oauth_access_token', 'oauth_refresh_token')
+USER_CACHE_COLUMNS = tuple(column.key for column in User.__table__.c if column.key not in USER_SECRET_COLUMNS)
+
+def _shared_user_key(user_id):
+    return f'user-columns:{user_id}'
+
+def forget_user(user_id):
+    """
+    Drop a user from the shared user cache.
+    """
+    try:
+        cache.delete(_shared_user_key(user_id))
+    except redis.RedisError:
+        # The entry lapses after USER_CACHE_TIMEOUT; nothing else to do without Redis
+        app.logger.warning('Could not drop cached user %s', user_id)
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _forget_changed_user(mapper, connection, target):
+    forget_user(target.id)
+    # Another worker may re-cache the old row before this commit lands,
+    # so the entry is dropped once more after the commit
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_user_ids', set()).add(target.id)
+
+@event.listens_for(Session, 'after_commit')
+def _forget_committed_users(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        forget_user(user_id)
+
+def _cached_user(user_id):
+    """
+    Rebuild a cached user and attach it to the current session without SQL.
+    """
+    try:
+        values = cache.get(_shared_user_key(user_id))
+    except redis.RedisError:
+        return None  # Redis is down; the caller loads the row instead
+    if values is None:
+        return None
+    user = User(**values)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
 
 @login.user_loader
 def load_user(id):
     """
     Load user by ID for Flask-Login.
+    Lookups are memoised on flask.g for the request (e.g. for GraphQL resolvers),
+    and in the shared Redis cache, so most requests skip the SELECT. If Redis is unavailable the row is loaded from
+    the database as usual.
     """
-    return User.query.get(int(id))
+    user_id = int(id)
+    request_cache = g.setdefault('_user_cache', {})
+    if user_id in request_cache:
+        return request_cache[user_id]
+    user = _cached_user(user_id)
+    if user is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            values = {key: getattr(user, key) for key in USER_CACHE_COLUMNS}
+            try:
+                cache.set(_shared_user_key(user_id), values, timeout=USER_CACHE_TIMEOUT)
+            except redis.RedisError:
+                pass  # Served from the database until Redis is back
+    request_cache[user_id] = user
+    return user
+
+def get_or_create_oauth_user(email):
+    """
+    Return the user for an OAuth email, creating it if needed. Returning
+    users, the common case, cost one SELECT. A new user's insert is
+    ON CONFLICT DO NOTHING on PostgreSQL and SQLite, so two concurrent first
+    logins cannot both create the user or fail on the unique constraint;
+    PostgreSQL hands back the inserted row with RETURNING.
+    Returns None if the email is free but its username is already taken.
+    """
+    by_email = select(User).where(User.email == email)
+    user = db.session.execute(by_email).scalar_one_or_none()
+    if user is not None:
+        return user
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        stmt = (
+            insert(User).values(username=email, email=email)
+            .on_conflict_do_nothing()
+            .returning(*User.__table__.c)
+        )
+        user = db.session.execute(select(User).from_statement(stmt)).scalar_one_or_none()
+        if user is not None:
+            return user
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        db.session.execute(insert(User).values(username=email, email=email).on_conflict_do_nothing())
+    else:
+        user = User(username=email, email=email)
+        db.session.add(user)
+        db.session.flush()
+        return user
+    # Lost a race to a concurrent login, or the username is taken
+    return db.session.execute(by_email).scalar_one_or_none()
 
 class Transaction(db.Model):
     """
     Transaction model for storing income and expense details.
     """
+    __table_args__ = (
+        # Covers search on PostgreSQL: every selected column is in the index,
+        # so pages are answered by index-only scans
+        db.Index('ix_txn_user_date_cat', 'user_id', 'date', 'category', postgresql_include=['id', 'amount']),
+        db.Index('ix_txn_user_cat_date', 'user_id', 'category', 'date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     amount = db.Column(db.Float, nullable=False)
     category = db.Column(db.String(64), nullable=False)
@@ -53,23 +230,30 @@ class Transaction(db.Model):
     description = db.Column(db.String(255))
     receipt = db.Column(db.String(255))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user = db.relationship('User', back_populates='transactions')
 
     def __repr__(self):
-        return f'<Transaction {self.amount} {self.category}>'
+        return f'<{type(self).__name__} id={self.id}>'
 
 class RecurringTransaction(db.Model):
     """
     RecurringTransaction model for storing recurring income and expense details.
     """
+    __table_args__ = (
+        db.Index('ix_recur_next_date', 'next_date'),
+        db.Index('ix_recur_user_next_date', 'user_id', 'next_date'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     amount = db.Column(db.Float, nullable=False)
     category = db.Column(db.String(64), nullable=False)
     interval = db.Column(db.String(64), nullable=False)
     next_date = db.Column(db.DateTime, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user = db.relationship('User', back_populates='recurring_transactions')
 
     def __repr__(self):
-        return f'<RecurringTransaction {self.amount} {self.category} {self.interval}>'
+        return f'<{type(self).__name__} id={self.id}>'
 
 class ActivityLog(db.Model):
     """
@@ -79,9 +263,10 @@ class ActivityLog(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     action = db.Column(db.String(255))
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    user = db.relationship('User', back_populates='activity_logs')
 
     def __repr__(self):
-        return f'<ActivityLog {self.user_id} {self.action}>'
+        return f'<{type(self).__name__} id={self.id}>'
 
 class Investment(db.Model):
     """
@@ -90,7 +275,7 @@ class Investment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), nullable=False)
     amount = db.Column(db.Float, nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
 
     def __repr__(self):
         return f'<Investment {self.name} {self.amount}>'
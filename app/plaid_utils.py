@@ -1,34 +1,89 @@
 # app/plaid_utils.py
 
 import os
-from plaid import Client
-from plaid.model.accounts_get_request import AccountsGetRequest
-from plaid.model.transactions_get_request import TransactionsGetRequest
-from plaid.api import plaid_api
-from app import app
-
-client = Client(
-    client_id=os.getenv('PLAID_CLIENT_ID'),
-    secret=os.getenv('PLAID_SECRET'),
-    environment=os.getenv('PLAID_ENV')
-)
+import threading
+from functools import lru_cache
+from itertools import islice
+from cachetools import TTLCache
+from app import app, db
+from app.models import Transaction
+
+@lru_cache(maxsize=1)
+def get_client():
+    """
+    Plaid client, created on first use so that workers which never call
+    Plaid do not pay for importing the SDK.
+    """
+    from plaid import Client
+    return Client(
+        client_id=os.getenv('PLAID_CLIENT_ID'),
+        secret=os.getenv('PLAID_SECRET'),
+        environment=os.getenv('PLAID_ENV')
+    )
+
+# Plaid results for the same token and window are identical, so reuse them briefly
+_response_cache = TTLCache(maxsize=256, ttl=60)
+_response_cache_lock = threading.Lock()
+
+def _cached(key, fetch):
+    """
+    Return the cached response for key, calling fetch() on a miss.
+    """
+    with _response_cache_lock:
+        if key in _response_cache:
+            return _response_cache[key]
+    value = fetch()
+    with _response_cache_lock:
+        _response_cache[key] = value
+    return value
 
 def get_accounts(access_token):
     """
     Fetch accounts linked to a user's bank.
     """
-    request = AccountsGetRequest(access_token=access_token)
-    response = client.accounts_get(request)
-    return response['accounts']
+    def fetch():
+        from plaid.model.accounts_get_request import AccountsGetRequest
+        request = AccountsGetRequest(access_token=access_token)
+        return get_client().accounts_get(request)['accounts']
+    return _cached(('accounts', access_token), fetch)
 
 def get_transactions(access_token, start_date, end_date):
     """
     Fetch transactions for a given period.
     """
-    request = TransactionsGetRequest(
-        access_token=access_token,
-        start_date=start_date,
-        end_date=end_date
+    def fetch():
+        from plaid.model.transactions_get_request import TransactionsGetRequest
+        request = TransactionsGetRequest(
+            access_token=access_token,
+            start_date=start_date,
+            end_date=end_date
+        )
+        return get_client().transactions_get(request)['transactions']
+    return _cached(('transactions', access_token, start_date, end_date), fetch)
+
+# Rows per INSERT when importing, so memory stays bounded by one chunk
+INGEST_CHUNK_SIZE = 1000
+
+def ingest_plaid_transactions(user_id, transactions):
+    """
+    Insert Plaid transactions for a user with one executemany INSERT per
+    INGEST_CHUNK_SIZE rows, instead of adding one ORM object per row.
+    The caller commits.
+    """
+    rows = (
+        {
+            'amount': txn['amount'],
+            'category': txn['category'][0],
+            'date': txn['date'],
+            'description': txn['name'],
+            'user_id': user_id
+        }
+        for txn in transactions
     )
-    response = client.transactions_get(request)
-    return response['transactions']
+    count = 0
+    while True:
+        chunk = list(islice(rows, INGEST_CHUNK_SIZE))
+        if not chunk:
+            return count
+        db.session.execute(Transaction.__table__.insert(), chunk)
+        count += len(chunk)
@@ -40,10 +40,10 @@ Routes:
 Utilities:
     - admin_required: Decorator to restrict access to admin users.
     - user_required: Decorator to restrict access to regular users.
-    - log_activity: Logs user activity.
+    - log_activity: Logs user activity (buffered and written in batches by app.activity_logger).
     - generate_confirmation_token: Generates an email confirmation token.
     - confirm_token: Confirms the token and returns the email.
-    - send_email: Sends an email.
+    - send_email: Queues an email for the Celery worker.
     - check_session_timeout: Checks if the session has timed out.
 
 Dependencies:
@@ -66,23 +66,32 @@ Dependencies:
     - Flask-Swagger-UI: API documentation using Swagger.
 """
 
-from flask import render_template, flash, redirect, url_for, request, abort, session, jsonify, send_file
-from app import app, db, google, facebook, limiter, admin_permission, user_permission, mail, scheduler, photos, socketio
+from flask import render_template, flash, redirect, url_for, request, abort, session, jsonify, send_from_directory, make_response, Response, stream_with_context
+from app import app, db, google, facebook, limiter, admin_permission, user_permission, photos, redis_client, cache, http_session
 from app.forms import LoginForm, RegistrationForm, ProfileForm, ChangePasswordForm, Enable2FAForm, Verify2FAForm, RecurringTransactionForm, SearchForm, InvestmentForm, TransactionForm, BackupForm, RestoreForm, CategorizeTransactionForm, PlaidLinkForm, NotificationForm, NotificationPreferencesForm, EmailVerificationForm, DeleteAccountForm, SocialShareForm, UploadProfilePictureForm, FraudDetectionForm
-from app.models import User, Transaction, RecurringTransaction, ActivityLog, Investment, Role, UserNotification, FraudDetection
-from app.plaid_utils import get_accounts, get_transactions
+from app.models import check_login, get_or_create_oauth_user, User, Transaction, RecurringTransaction, ActivityLog, Investment, Role, UserNotification, FraudDetection
+from app.activity_logger import log_activity
+from app.tasks import get_cached_oauth_token, store_oauth_token
+from app.celery_tasks import send_email_task, import_plaid_transactions_task, resize_profile_picture_task
 from flask_login import current_user, login_user, logout_user, login_required
-from werkzeug.utils import secure_filename
-from werkzeug.urls import url_parse
-from functools import wraps
+from sqlalchemy import select, bindparam, extract, func, and_, or_, cast, literal, literal_column, Text
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+from sqlalchemy.orm import undefer_group
+from werkzeug.utils import safe_join
+from functools import wraps, lru_cache
+import hashlib
+import hmac
 import pyotp
+import redis
 import os
-import json
-import joblib
+import re
+import secrets
+import zlib
+import ijson
+import msgpack
+import orjson
 from itsdangerous import URLSafeTimedSerializer
-from flask_mail import Message
 from datetime import datetime, timedelta
-import requests
 
 def admin_required(f):
     """
@@ -106,69 +115,85 @@ def user_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def log_activity(user_id, action):
+@lru_cache(maxsize=1)
+def get_token_serializer():
     """
-    Log user activity.
+    Email confirmation token serializer, built once on first use.
     """
-    activity = ActivityLog(user_id=user_id, action=action)
-    db.session.add(activity)
-    db.session.commit()
+    return URLSafeTimedSerializer(app.config['SECRET_KEY'], salt=app.config['SECURITY_PASSWORD_SALT'])
 
 def generate_confirmation_token(email):
     """
     Generate an email confirmation token.
     """
-    serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
-    return serializer.dumps(email, salt=app.config['SECURITY_PASSWORD_SALT'])
+    return get_token_serializer().dumps(email)
 
 def confirm_token(token, expiration=3600):
     """
     Confirm the token and return the email.
     """
-    serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
     try:
-        email = serializer.loads(
-            token,
-            salt=app.config['SECURITY_PASSWORD_SALT'],
-            max_age=expiration
-        )
+        email = get_token_serializer().loads(token, max_age=expiration)
     except:
         return False
     return email
 
 def send_email(to, subject, template):
     """
-    Send an email.
+    Send an email. The message is queued for a Celery worker, so the
+    request does not wait on the SMTP server.
     """
-    msg = Message(
-        subject,
-        recipients=[to],
-        html=template,
-        sender=app.config['MAIL_DEFAULT_SENDER']
-    )
-    mail.send(msg)
+    send_email_task.delay(to, subject, template)
+
+# Seconds of slack allowed on last_activity before the session is rewritten
+SESSION_ACTIVITY_RESOLUTION = 60
 
 def check_session_timeout():
     """
     Check if the session has timed out and log out the user if necessary.
     """
-    if 'last_activity' in session:
-        now = datetime.now()
-        last_activity = session['last_activity']
-        if (now - last_activity).seconds > app.permanent_session_lifetime.seconds:
+    now = datetime.now()
+    last_activity = session.get('last_activity')
+    if last_activity is not None:
+        idle = (now - last_activity).total_seconds()
+        if idle > app.permanent_session_lifetime.total_seconds():
             session.pop('user_id', None)
             flash('Session timed out. Please log in again.', 'warning')
             return redirect(url_for('login'))
-    session['last_activity'] = datetime.now()
+        if idle <= SESSION_ACTIVITY_RESOLUTION:
+            # Recent enough; leave the stored timestamp as it is
+            return None
+    session['last_activity'] = now
 
 @app.before_request
 def before_request():
     """
     Ensure session timeout is checked before each request.
+    Static files and unmatched URLs are skipped, so they neither load the
+    user nor touch the session.
     """
+    if request.endpoint in (None, 'static'):
+        return None
     if current_user.is_authenticated:
         check_session_timeout()
 
+@app.after_request
+def commit_session(response):
+    """
+    Commit the request's changes in one transaction once the view has run,
+    so a request costs at most one commit. Error responses roll back instead.
+    Only register and restore commit themselves: register must not email a
+    confirmation link before the account exists, and restore commits in
+    batches and reports a failed import itself.
+    """
+    session = db.session()
+    if session.in_transaction():
+        if response.status_code < 400:
+            session.commit()
+        else:
+            session.rollback()
+    return response
+
 @app.route('/')
 @app.route('/index')
 @login_required
@@ -177,11 +202,53 @@ def index():
     Home page route.
     """
     # Load user dashboard configuration
-    dashboard_config = json.loads(current_user.dashboard_config)
+    dashboard_config = current_user.dashboard_config or {}
     return render_template('index.html', title='Home', dashboard_config=dashboard_config)
 
+# Built once; the username is bound per call, so the compiled SQL is reused
+LOGIN_STMT = select(User).where(User.username == bindparam('username')).options(undefer_group('secrets')).limit(1)
+
+def get_login_username_key():
+    """
+    Rate limit key for the username being tried, hashed like the IP key.
+    """
+    username = request.form.get('username', '').strip().lower()
+    return 'login:' + hashlib.blake2s(username.encode()).hexdigest()
+
+def login_locked():
+    """
+    Whether the username being tried has hit LOGIN_MAX_FAILURES recently.
+    Checked before the user is loaded or any password hash runs; if Redis
+    is unavailable the check is skipped, as the rate limiter does.
+    """
+    try:
+        failures = redis_client.get('failures:' + get_login_username_key())
+    except redis.RedisError:
+        return False
+    return failures is not None and int(failures) >= app.config['LOGIN_MAX_FAILURES']
+
+def record_login_failure():
+    """
+    Count a failed login; the count expires LOGIN_LOCKOUT_SECONDS after the last failure.
+    """
+    key = 'failures:' + get_login_username_key()
+    try:
+        redis_client.pipeline().incr(key).expire(key, app.config['LOGIN_LOCKOUT_SECONDS']).execute()
+    except redis.RedisError:
+        app.logger.warning('Could not record failed login')
+
+def clear_login_failures():
+    """
+    Reset the failed login count after a successful password check.
+    """
+    try:
+        redis_client.delete('failures:' + get_login_username_key())
+    except redis.RedisError:
+        pass
+
 @app.route('/login', methods=['GET', 'POST'])
 @limiter.limit("10 per minute")  # Rate limiting for login attempts
+@limiter.limit("5 per minute", key_func=get_login_username_key, methods=['POST'])  # Per account, before the password hash runs
 def login():
     """
     Login page route.
@@ -190,10 +257,15 @@ def login():
         return redirect(url_for('index'))
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.query.filter_by(username=form.username.data).first()
-        if user is None or not user.check_password(form.password.data):
+        if login_locked():
+            flash('Too many failed attempts. Please try again later.', 'danger')
+            return redirect(url_for('login'))
+        user = db.session.execute(LOGIN_STMT, {'username': form.username.data}).scalar_one_or_none()
+        if not check_login(user, form.password.data):
+            record_login_failure()
             flash('Invalid username or password', 'danger')
             return redirect(url_for('login'))
+        clear_login_failures()
         if not user.email_verified:
             flash('Please verify your email before logging in.', 'warning')
             return redirect(url_for('resend_verification'))
@@ -203,7 +275,8 @@ def login():
         login_user(user, remember=form.remember_me.data)
         log_activity(user.id, 'User logged in')
         next_page = request.args.get('next')
-        if not next_page or url_parse(next_page).netloc != '':
+        # Only same-site paths; browsers read '//host' (or a backslash variant) as another host
+        if not next_page or not next_page.startswith('/') or next_page.startswith(('//', '/\\')):
             next_page = url_for('index')
         return redirect(next_page)
     return render_template('login.html', title='Sign In', form=form)
@@ -215,6 +288,25 @@ def login_google():
     """
     return google.authorize(callback=url_for('authorized', _external=True))
 
+def oauth_user_info(remote, path, access_token):
+    """
+    Fetch the provider's profile for an access token, caching it for five
+    minutes so a repeated callback with the same token skips the HTTPS call.
+    If Redis is unavailable the profile is fetched live every time.
+    """
+    key = 'oauth_info:' + hashlib.sha256(access_token.encode()).hexdigest()
+    try:
+        info = cache.get(key)
+    except redis.RedisError:
+        info = None
+    if info is None:
+        info = remote.get(path).data
+        try:
+            cache.set(key, info, timeout=300)
+        except redis.RedisError:
+            pass  # Fetched live again next time
+    return info
+
 @app.route('/login/google/authorized')
 def authorized():
     """
@@ -229,14 +321,12 @@ def authorized():
         return redirect(url_for('login'))
 
     session['google_token'] = (response['access_token'], '')
-    user_info = google.get('userinfo')
-    # Implement your logic to handle user info and login/register the user
-    # Example: Check if user exists, if not, create a new user
-    user = User.query.filter_by(email=user_info.data['email']).first()
+    user_info = oauth_user_info(google, 'userinfo', response['access_token'])
+    user = get_or_create_oauth_user(user_info['email'])
     if user is None:
-        user = User(username=user_info.data['email'], email=user_info.data['email'])
-        db.session.add(user)
-        db.session.commit()
+        flash('An account with this username already exists.', 'danger')
+        return redirect(url_for('login'))
+    store_oauth_token(user, 'google', response)
     login_user(user)
     log_activity(user.id, 'User logged in with Google')
     return redirect(url_for('index'))
@@ -244,8 +334,12 @@ def authorized():
 @google.tokengetter
 def get_google_oauth_token():
     """
-    Retrieve Google OAuth token.
+    Retrieve Google OAuth token, preferring the copy kept fresh by the refresh job.
     """
+    if current_user.is_authenticated:
+        token = get_cached_oauth_token('google', current_user.id)
+        if token is not None:
+            return (token, '')
     return session.get('google_token')
 
 @app.route('/login/facebook')
@@ -269,14 +363,12 @@ def facebook_authorized():
         return redirect(url_for('login'))
 
     session['facebook_token'] = (response['access_token'], '')
-    user_info = facebook.get('me?fields=id,email')
-    # Implement your logic to handle user info and login/register the user
-    # Example: Check if user exists, if not, create a new user
-    user = User.query.filter_by(email=user_info.data['email']).first()
+    user_info = oauth_user_info(facebook, 'me?fields=id,email', response['access_token'])
+    user = get_or_create_oauth_user(user_info['email'])
     if user is None:
-        user = User(username=user_info.data['email'], email=user_info.data['email'])
-        db.session.add(user)
-        db.session.commit()
+        flash('An account with this username already exists.', 'danger')
+        return redirect(url_for('login'))
+    store_oauth_token(user, 'facebook', response)
     login_user(user)
     log_activity(user.id, 'User logged in with Facebook')
     return redirect(url_for('index'))
@@ -284,8 +376,12 @@ def facebook_authorized():
 @facebook.tokengetter
 def get_facebook_oauth_token():
     """
-    Retrieve Facebook OAuth token.
+    Retrieve Facebook OAuth token, preferring the copy kept fresh by the refresh job.
     """
+    if current_user.is_authenticated:
+        token = get_cached_oauth_token('facebook', current_user.id)
+        if token is not None:
+            return (token, '')
     return session.get('facebook_token')
 
 @app.route('/logout')
@@ -309,7 +405,14 @@ def register():
         user = User(username=form.username.data, email=form.email.data)
         user.set_password(form.password.data)
         db.session.add(user)
-        db.session.commit()
+        # Commit before queueing the email, so a confirmation link is only
+        # sent for an account that was actually created
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('That username or email is already registered.', 'danger')
+            return render_template('register.html', title='Register', form=form)
         token = generate_confirmation_token(user.email)
         confirm_url = url_for('confirm_email', token=token, _external=True)
         html = render_template('activate.html', confirm_url=confirm_url)
@@ -334,7 +437,6 @@ def confirm_email(token):
         flash('Account already confirmed. Please login.', 'success')
     else:
         user.email_verified = True
-        db.session.commit()
         flash('You have confirmed your account. Thanks!', 'success')
     return redirect(url_for('login'))
 
@@ -362,7 +464,6 @@ def profile():
         current_user.username = form.username.data
         current_user.email = form.email.data
         current_user.currency = form.currency.data  # Save selected currency
-        db.session.commit()
         log_activity(current_user.id, 'User updated profile')
         flash('Your profile has been updated!', 'success')
         return redirect(url_for('profile'))
@@ -381,8 +482,9 @@ def change_password():
     form = ChangePasswordForm()
     if form.validate_on_submit():
         if current_user.check_password(form.old_password.data):
-            current_user.set_password(form.new_password.data)
-            db.session.commit()
+            # Skip the KDF when the new password is the one just verified
+            if not hmac.compare_digest(form.new_password.data.encode(), form.old_password.data.encode()):
+                current_user.set_password(form.new_password.data)
             log_activity(current_user.id, 'User changed password')
             flash('Your password has been updated!', 'success')
             return redirect(url_for('profile'))
@@ -399,6 +501,26 @@ def admin_dashboard():
     """
     return render_template('admin_dashboard.html', title='Admin Dashboard')
 
+@cache.memoize()
+def monthly_spending(user_id):
+    """
+    Total transaction amount per month for a user, oldest month first.
+    Cached for CACHE_DEFAULT_TIMEOUT seconds; views that add transactions
+    call cache.delete_memoized(monthly_spending, user_id).
+    """
+    year = extract('year', Transaction.date)
+    month = extract('month', Transaction.date)
+    stmt = (
+        select(year, month, func.sum(Transaction.amount))
+        .where(Transaction.user_id == user_id)
+        .group_by(year, month)
+        .order_by(year, month)
+    )
+    rows = db.session.execute(stmt).all()
+    labels = [f'{int(y)}-{int(m):02d}' for y, m, _ in rows]
+    data = [total for _, _, total in rows]
+    return labels, data
+
 @app.route('/analytics')
 @login_required
 @user_required
@@ -407,25 +529,39 @@ def analytics():
     Financial analytics page route.
     Provides data for financial trend analysis.
     """
-    # Example data, replace with your query to fetch actual data
-    labels = ['January', 'February', 'March', 'April', 'May', 'June', 'July']
-    data = [100, 200, 150, 300, 250, 400, 350]
-    return render_template('analytics.html', labels=labels, data=data)
+    labels, data = monthly_spending(current_user.id)
+    # Revalidated on every visit; an unchanged page is answered with an empty 304
+    response = make_response(render_template('analytics.html', labels=labels, data=data))
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
+
+@lru_cache(maxsize=4096)
+def totp_for(secret):
+    """
+    TOTP generator for a 2FA secret, built once per secret.
+    """
+    return pyotp.TOTP(secret)
 
 @app.route('/enable_2fa', methods=['GET', 'POST'])
 @login_required
 def enable_2fa():
     """
     Enable two-factor authentication route.
+    The secret shown in the QR code is kept in the session until the form
+    is submitted, so the stored secret is the one the user scanned.
     """
     form = Enable2FAForm()
+    secret = session.get('pending_2fa_secret')
+    if secret is None:
+        secret = session['pending_2fa_secret'] = pyotp.random_base32()
     if form.validate_on_submit():
         current_user.two_factor_enabled = True
-        current_user.two_factor_secret = pyotp.random_base32()
-        db.session.commit()
+        current_user.two_factor_secret = session.pop('pending_2fa_secret')
         flash('Two-factor authentication has been enabled!', 'success')
         return redirect(url_for('profile'))
-    return render_template('enable_2fa.html', title='Enable 2FA', form=form, secret=pyotp.random_base32())
+    return render_template('enable_2fa.html', title='Enable 2FA', form=form, secret=secret)
 
 @app.route('/verify_2fa', methods=['GET', 'POST'])
 def verify_2fa():
@@ -434,10 +570,10 @@ def verify_2fa():
     """
     if '2fa_user_id' not in session:
         return redirect(url_for('login'))
-    user = User.query.get(session['2fa_user_id'])
+    user = db.session.get(User, session['2fa_user_id'], options=[undefer_group('secrets')])
     form = Verify2FAForm()
     if form.validate_on_submit():
-        totp = pyotp.TOTP(user.two_factor_secret)
+        totp = totp_for(user.two_factor_secret)
         if totp.verify(form.token.data):
             login_user(user)
             session.pop('2fa_user_id')
@@ -465,12 +601,54 @@ def recurring_transactions():
             user_id=current_user.id
         )
         db.session.add(transaction)
-        db.session.commit()
         log_activity(current_user.id, 'Added recurring transaction')
         flash('Recurring transaction has been added!', 'success')
         return redirect(url_for('recurring_transactions'))
-    transactions = RecurringTransaction.query.filter_by(user_id=current_user.id).all()
-    return render_template('recurring_transactions.html', title='Recurring Transactions', form=form, transactions=transactions)
+    page = request.args.get('page', 1, type=int)
+    # Only the columns the listing shows; rows are plain tuples, not ORM objects
+    pagination = RecurringTransaction.query.with_entities(
+        RecurringTransaction.amount, RecurringTransaction.category,
+        RecurringTransaction.interval, RecurringTransaction.next_date
+    ).filter_by(user_id=current_user.id).order_by(RecurringTransaction.next_date).paginate(page=page, per_page=50, error_out=False)
+    return render_template('recurring_transactions.html', title='Recurring Transactions', form=form,
+                           transactions=pagination.items, pagination=pagination)
+
+SEARCH_PAGE_SIZE = 50
+
+@lru_cache(maxsize=16)
+def search_statement(has_start_date, has_end_date, has_category, has_cursor):
+    """
+    Build the transaction search statement for one combination of filters.
+    Values are bound at execution time, so each variant is built only once.
+    Results are newest first, one page at a time; a page after the first
+    seeks past the (date, id) of the previous page's last row.
+    """
+    # Only the listed columns plus the id for the cursor; rows are plain tuples
+    stmt = select(
+        Transaction.id, Transaction.date, Transaction.amount, Transaction.category
+    ).where(Transaction.user_id == bindparam('user_id'))
+    if has_start_date:
+        stmt = stmt.where(Transaction.date >= bindparam('start_date'))
+    if has_end_date:
+        stmt = stmt.where(Transaction.date <= bindparam('end_date'))
+    if has_category:
+        stmt = stmt.where(Transaction.category == bindparam('category'))
+    if has_cursor:
+        stmt = stmt.where(or_(
+            Transaction.date < bindparam('after_date'),
+            and_(Transaction.date == bindparam('after_date'), Transaction.id < bindparam('after_id'))
+        ))
+    # One extra row tells the view whether another page follows
+    return stmt.order_by(Transaction.date.desc(), Transaction.id.desc()).limit(SEARCH_PAGE_SIZE + 1)
+
+def search_cursor():
+    """
+    The (date, id) seek position submitted with a 'next page' request, if any.
+    """
+    try:
+        return datetime.fromisoformat(request.form['after_date']), int(request.form['after_id'])
+    except (KeyError, ValueError):
+        return None
 
 @app.route('/search', methods=['GET', 'POST'])
 @login_required
@@ -481,17 +659,25 @@ def search():
     """
     form = SearchForm()
     transactions = []
+    next_cursor = None
     if form.validate_on_submit():
-        query = Transaction.query.filter_by(user_id=current_user.id)
+        params = {'user_id': current_user.id}
         if form.start_date.data:
-            query = query.filter(Transaction.date >= form.start_date.data)
+            params['start_date'] = form.start_date.data
         if form.end_date.data:
-            query = query.filter(Transaction.date <= form.end_date.data)
+            params['end_date'] = form.end_date.data
         if form.category.data:
-            query = query.filter_by(category=form.category.data)
-        transactions = query.all()
+            params['category'] = form.category.data
+        cursor = search_cursor()
+        if cursor is not None:
+            params['after_date'], params['after_id'] = cursor
+        stmt = search_statement('start_date' in params, 'end_date' in params, 'category' in params, cursor is not None)
+        transactions = db.session.execute(stmt, params).all()
+        if len(transactions) > SEARCH_PAGE_SIZE:
+            transactions = transactions[:SEARCH_PAGE_SIZE]
+            next_cursor = (transactions[-1].date.isoformat(), transactions[-1].id)
         log_activity(current_user.id, 'Performed search')
-    return render_template('search.html', title='Search', form=form, transactions=transactions)
+    return render_template('search.html', title='Search', form=form, transactions=transactions, next_cursor=next_cursor)
 
 @app.route('/investments', methods=['GET', 'POST'])
 @login_required
@@ -508,13 +694,70 @@ def investments():
             user_id=current_user.id
         )
         db.session.add(investment)
-        db.session.commit()
         log_activity(current_user.id, 'Added investment')
         flash('Investment has been added!', 'success')
         return redirect(url_for('investments'))
-    investments = Investment.query.filter_by(user_id=current_user.id).all()
+    investments = db.session.execute(
+        select(Investment.name, Investment.amount).where(Investment.user_id == current_user.id)
+    ).all()
     return render_template('investments.html', title='Investments', form=form, investments=investments)
 
+def get_user_transaction_or_404(transaction_id, for_update=False):
+    """
+    Load one of the current user's transactions, or abort with 404.
+    Ownership is part of the WHERE clause, so another user's id is answered
+    by the database without loading the row; for_update locks the row until
+    the request commits.
+    """
+    stmt = select(Transaction).filter_by(id=transaction_id, user_id=current_user.id)
+    if for_update:
+        stmt = stmt.with_for_update()
+    transaction = db.session.execute(stmt).scalar_one_or_none()
+    if transaction is None:
+        abort(404)
+    return transaction
+
+# Receipt names come from the content hash; only a plain extension is kept
+RECEIPT_EXT_RE = re.compile(r'\.[a-z0-9]{1,10}\Z')
+
+# Mode requested for stored receipts; the kernel applies the process umask.
+# Readable by a front-end server serving them via X-Accel-Redirect.
+RECEIPT_FILE_MODE = 0o644
+
+def save_receipt(file):
+    """
+    Store an uploaded receipt under the SHA-256 of its contents, as
+    '<first two hex digits>/<digest><ext>' inside UPLOAD_FOLDER, and return
+    that relative name. Identical receipts are stored once, uploads can no
+    longer overwrite each other, and the two-character subdirectories keep
+    any one directory small.
+    """
+    folder = app.config['UPLOAD_FOLDER']
+    os.makedirs(folder, exist_ok=True)
+    # Hash while copying to a temporary file, so the upload is read only once
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(folder, f'.upload-{secrets.token_hex(8)}')
+    try:
+        fd = os.open(tmp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, RECEIPT_FILE_MODE)
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in iter(lambda: file.stream.read(64 * 1024), b''):
+                digest.update(chunk)
+                tmp.write(chunk)
+        digest = digest.hexdigest()
+        ext = os.path.splitext(file.filename or '')[1].lower()
+        if not RECEIPT_EXT_RE.match(ext):
+            ext = ''
+        name = f'{digest[:2]}/{digest}{ext}'
+        path = os.path.join(folder, name)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+    finally:
+        # Left over if the receipt already existed or the upload failed midway
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return name
+
 @app.route('/upload_receipt/<int:transaction_id>', methods=['GET', 'POST'])
 @login_required
 @user_required
@@ -524,29 +767,148 @@ def upload_receipt(transaction_id):
     """
     form = TransactionForm()
     if form.validate_on_submit():
-        transaction = Transaction.query.get(transaction_id)
-        if transaction.user_id != current_user.id:
-            abort(403)
-        file = form.receipt.data
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        transaction.receipt = filename
-        db.session.commit()
+        transaction = get_user_transaction_or_404(transaction_id, for_update=True)
+        transaction.receipt = save_receipt(form.receipt.data)
         log_activity(current_user.id, f'Uploaded receipt for transaction {transaction_id}')
         flash('Receipt has been uploaded!', 'success')
         return redirect(url_for('index'))
     return render_template('upload_receipt.html', title='Upload Receipt', form=form)
 
-@app.route('/uploads/<filename>')
+@app.route('/uploads/<path:filename>')
 @login_required
 @user_required
 def uploaded_file(filename):
     """
     Serve uploaded receipt files.
-    """
+    Behind nginx the file is handed off with X-Accel-Redirect, so the worker
+    returns immediately instead of streaming the bytes itself.
+    """
+    prefix = app.config['UPLOADS_ACCEL_REDIRECT_PREFIX']
+    if prefix:
+        path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        if path is None or not os.path.isfile(path):
+            abort(404)
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + filename
+        del response.headers['Content-Type']  # nginx sets it from the file's extension
+        return response
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
+# Columns written to backups and exports for each kind of user data.
+# Ids and owners are left out so a backup can be restored into any account.
+USER_DATA_COLUMNS = {
+    'transactions': (Transaction, ('amount', 'category', 'date', 'description', 'receipt')),
+    'investments': (Investment, ('name', 'amount')),
+    'recurring_transactions': (RecurringTransaction, ('amount', 'category', 'interval', 'next_date')),
+}
+
+USER_DATA_BATCH_SIZE = 1000
+
+def iter_user_data(user_id):
+    """
+    Yield a user's transactions, investments and recurring transactions as
+    chunks of one JSON document, encoded with orjson, which writes datetimes
+    as ISO 8601 natively. Plain column selects are streamed in batches of
+    USER_DATA_BATCH_SIZE rows, so no ORM objects are built and memory does
+    not grow with the row count; all three run in one transaction.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        yield dump_user_data_pg(user_id)
+        return
+    yield b'{'
+    for index, (key, (model, columns)) in enumerate(USER_DATA_COLUMNS.items()):
+        stmt = (
+            select(*(getattr(model, name) for name in columns))
+            .where(model.user_id == user_id)
+            .execution_options(stream_results=True)
+        )
+        yield (b',' if index else b'') + orjson.dumps(key) + b':['
+        separator = b''
+        for rows in db.session.execute(stmt).mappings().partitions(USER_DATA_BATCH_SIZE):
+            yield separator + b','.join(orjson.dumps(dict(row)) for row in rows)
+            separator = b','
+        yield b']'
+    yield b'}'
+
+def dump_user_data_pg(user_id):
+    """
+    PostgreSQL variant of iter_user_data: the database builds each section as
+    JSON text with json_agg, all three in one statement, and Python only
+    joins the fragments.
+    """
+    sections = []
+    for key, (model, columns) in USER_DATA_COLUMNS.items():
+        fields = []
+        for name in columns:
+            fields += [literal(name), getattr(model, name)]
+        aggregate = func.coalesce(func.json_agg(func.json_build_object(*fields)), literal_column("'[]'::json"))
+        sections.append(
+            select(cast(aggregate, Text)).where(model.user_id == user_id).scalar_subquery().label(key)
+        )
+    row = db.session.execute(select(*sections)).one()
+    return b'{' + b','.join(
+        orjson.dumps(key) + b':' + fragment.encode() for key, fragment in zip(USER_DATA_COLUMNS, row)
+    ) + b'}'
+
+def gzip_chunks(chunks):
+    """
+    Compress a stream of byte chunks into one gzip member as they arrive.
+    """
+    compressor = zlib.compressobj(1, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def send_user_data(user_id, filename):
+    """
+    Stream a user's data as a JSON attachment. Clients that accept gzip get it
+    compressed on the wire; they decode it transparently, so the saved file
+    is still plain JSON that restore() can read.
+    """
+    chunks = iter_user_data(user_id)
+    gzipped = 'gzip' in request.accept_encodings
+    if gzipped:
+        chunks = gzip_chunks(chunks)
+    # Keep the request context, and with it the db session, until the last chunk
+    response = Response(stream_with_context(chunks), mimetype='application/json')
+    response.headers.set('Content-Disposition', 'attachment', filename=filename)
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+RESTORE_BATCH_SIZE = 1000
+
+def load_user_data_row(model, columns, row, user_id):
+    """
+    Turn one backed-up row into INSERT parameters owned by user_id,
+    parsing the ISO datetimes written by iter_user_data. Raises ValueError
+    for a row the table would not accept.
+    """
+    if not isinstance(row, dict):
+        raise ValueError('an entry is not an object')
+    values = {'user_id': user_id}
+    for name in columns:
+        column = model.__table__.c[name]
+        value = row.get(name)
+        if value is None:
+            if not column.nullable:
+                raise ValueError(f'{name} is missing')
+        elif isinstance(column.type, db.DateTime):
+            if not isinstance(value, str):
+                raise ValueError(f'{name} is not a date')
+            value = datetime.fromisoformat(value)
+        elif isinstance(column.type, db.Float):
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                raise ValueError(f'{name} is not a number')
+        elif isinstance(column.type, db.String):
+            if not isinstance(value, str) or (column.type.length and len(value) > column.type.length):
+                raise ValueError(f'{name} is not a valid string')
+        values[name] = value
+    return values
+
 @app.route('/backup', methods=['GET', 'POST'])
 @login_required
 @user_required
@@ -556,16 +918,8 @@ def backup():
     """
     form = BackupForm()
     if form.validate_on_submit():
-        user_data = {
-            'transactions': [t.serialize() for t in Transaction.query.filter_by(user_id=current_user.id).all()],
-            'investments': [i.serialize() for i in Investment.query.filter_by(user_id=current_user.id).all()],
-            'recurring_transactions': [rt.serialize() for rt in RecurringTransaction.query.filter_by(user_id=current_user.id).all()]
-        }
-        backup_path = os.path.join(app.config['BACKUP_FOLDER'], f'backup_{current_user.id}.json')
-        with open(backup_path, 'w') as backup_file:
-            json.dump(user_data, backup_file)
         flash('Your data has been backed up successfully!', 'success')
-        return send_from_directory(app.config['BACKUP_FOLDER'], f'backup_{current_user.id}.json', as_attachment=True)
+        return send_user_data(current_user.id, f'backup_{current_user.id}.json')
     return render_template('backup.html', title='Backup Data', form=form)
 
 @app.route('/restore', methods=['GET', 'POST'])
@@ -579,17 +933,38 @@ def restore():
     if form.validate_on_submit():
         file = form.backup_file.data
         if file:
-            data = json.load(file)
-            for t_data in data.get('transactions', []):
-                transaction = Transaction(**t_data)
-                db.session.add(transaction)
-            for i_data in data.get('investments', []):
-                investment = Investment(**i_data)
-                db.session.add(investment)
-            for rt_data in data.get('recurring_transactions', []):
-                recurring_transaction = RecurringTransaction(**rt_data)
-                db.session.add(recurring_transaction)
-            db.session.commit()
+            # Parse the upload once and check every row, so a malformed file
+            # inserts nothing
+            sections = dict.fromkeys(USER_DATA_COLUMNS, ())
+            try:
+                for key, records in ijson.kvitems(file.stream, '', use_float=True):
+                    if key not in USER_DATA_COLUMNS:
+                        continue
+                    if not isinstance(records, list):
+                        raise ValueError(f'{key} is not a list')
+                    model, columns = USER_DATA_COLUMNS[key]
+                    sections[key] = [load_user_data_row(model, columns, row, current_user.id) for row in records]
+            except ijson.JSONError:
+                flash('The backup file is not valid JSON.', 'danger')
+                return redirect(url_for('restore'))
+            except ValueError as exc:
+                flash(f'The backup file could not be restored: {exc}.', 'danger')
+                return redirect(url_for('restore'))
+            try:
+                # One commit per RESTORE_BATCH_SIZE rows, so a large restore
+                # does not hold its locks for the whole upload
+                for key, (model, columns) in USER_DATA_COLUMNS.items():
+                    rows = sections[key]
+                    for offset in range(0, len(rows), RESTORE_BATCH_SIZE):
+                        db.session.execute(model.__table__.insert(), rows[offset:offset + RESTORE_BATCH_SIZE])
+                        db.session.commit()
+            except SQLAlchemyError:
+                db.session.rollback()
+                app.logger.exception('Restore failed for user %s', current_user.id)
+                flash('The backup file could only be partly restored.', 'danger')
+                return redirect(url_for('restore'))
+            finally:
+                cache.delete_memoized(monthly_spending, current_user.id)
             flash('Your data has been restored successfully!', 'success')
             return redirect(url_for('index'))
     return render_template('restore.html', title='Restore Data', form=form)
@@ -602,11 +977,19 @@ def dashboard_config():
     Update user dashboard configuration route.
     """
     data = request.get_json()
-    current_user.dashboard_config = json.dumps(data)
-    db.session.commit()
+    current_user.dashboard_config = data
     log_activity(current_user.id, 'Updated dashboard configuration')
     return jsonify({'status': 'success'})
 
+@lru_cache(maxsize=1)
+def get_categorizer():
+    """
+    Load the transaction categorisation model once per process.
+    """
+    import joblib  # Deferred: pulls in numpy, which no other route needs
+    # Map the numpy arrays read-only so every worker shares the page cache copy
+    return joblib.load('model/transaction_categorizer.pkl', mmap_mode='r')
+
 @app.route('/categorize_transaction/<int:transaction_id>', methods=['GET', 'POST'])
 @login_required
 @user_required
@@ -614,15 +997,11 @@ def categorize_transaction(transaction_id):
     """
     Categorize transaction using machine learning model route.
     """
-    transaction = Transaction.query.get(transaction_id)
-    if transaction.user_id != current_user.id:
-        abort(403)
+    transaction = get_user_transaction_or_404(transaction_id, for_update=request.method == 'POST')
     form = CategorizeTransactionForm()
     if form.validate_on_submit():
-        model = joblib.load('model/transaction_categorizer.pkl')
-        category = model.predict([form.description.data])
+        category = get_categorizer().predict([form.description.data])
         transaction.category = category[0]
-        db.session.commit()
         log_activity(current_user.id, f'Categorized transaction {transaction_id}')
         flash('Transaction has been categorized!', 'success')
         return redirect(url_for('index'))
@@ -638,20 +1017,10 @@ def plaid_link():
     form = PlaidLinkForm()
     if form.validate_on_submit():
         access_token = 'YOUR_PLAID_ACCESS_TOKEN'
-        accounts = get_accounts(access_token)
-        transactions = get_transactions(access_token, start_date='2023-01-01', end_date='2023-12-31')
-        for txn in transactions:
-            new_transaction = Transaction(
-                amount=txn['amount'],
-                category=txn['category'][0],
-                date=txn['date'],
-                description=txn['name'],
-                user_id=current_user.id
-            )
-            db.session.add(new_transaction)
-        db.session.commit()
-        log_activity(current_user.id, 'Linked bank account with Plaid')
-        flash('Bank account linked and transactions imported!', 'success')
+        user_id = current_user.id
+        import_plaid_transactions_task.delay(user_id, access_token, '2023-01-01', '2023-12-31')
+        log_activity(user_id, 'Linked bank account with Plaid')
+        flash('Bank account linked! Your transactions are being imported.', 'success')
         return redirect(url_for('index'))
     return render_template('plaid_link.html', title='Link Bank Account', form=form)
 
@@ -678,13 +1047,12 @@ def notification_preferences():
     """
     form = NotificationPreferencesForm()
     if form.validate_on_submit():
-        current_user.notification_preferences = json.dumps(form.data)
-        db.session.commit()
+        current_user.notification_preferences = form.data
         log_activity(current_user.id, 'Updated notification preferences')
         flash('Notification preferences updated!', 'success')
         return redirect(url_for('notification_preferences'))
     elif request.method == 'GET':
-        form.data = json.loads(current_user.notification_preferences or '{}')
+        form.data = current_user.notification_preferences or {}
     return render_template('notification_preferences.html', title='Notification Preferences', form=form)
 
 @app.route('/export_data/<format>')
@@ -694,17 +1062,8 @@ def export_data(format):
     """
     Export user data in specified format (e.g., JSON, PDF).
     """
-    user_data = {
-        'transactions': [t.serialize() for t in Transaction.query.filter_by(user_id=current_user.id).all()],
-        'investments': [i.serialize() for i in Investment.query.filter_by(user_id=current_user.id).all()],
-        'recurring_transactions': [rt.serialize() for rt in RecurringTransaction.query.filter_by(user_id=current_user.id).all()]
-    }
-
     if format == 'json':
-        export_path = os.path.join(app.config['EXPORT_FOLDER'], f'export_{current_user.id}.json')
-        with open(export_path, 'w') as export_file:
-            json.dump(user_data, export_file)
-        return send_file(export_path, as_attachment=True)
+        return send_user_data(current_user.id, f'export_{current_user.id}.json')
 
     elif format == 'pdf':
         # Logic to export data as PDF
@@ -725,7 +1084,6 @@ def delete_account():
         user = current_user
         log_activity(user.id, 'User deleted account')
         db.session.delete(user)
-        db.session.commit()
         flash('Your account has been deleted.', 'success')
         return redirect(url_for('login'))
     return render_template('delete_account.html', title='Delete Account', form=form)
@@ -744,6 +1102,27 @@ def share_goal():
         return redirect(url_for('index'))
     return render_template('share_goal.html', title='Share Goal', form=form)
 
+def exchange_rates(base_currency):
+    """
+    Fetch the exchange rates for a base currency, caching them for five
+    minutes; rates change slowly and the API quota is small. If Redis is
+    unavailable the rates are served uncached.
+    """
+    key = f'fx:{base_currency}'
+    try:
+        data = cache.get(key)
+    except redis.RedisError:
+        data = None
+    if data is None:
+        response = http_session.get(f'https://api.exchangerate-api.com/v4/latest/{base_currency}', timeout=2)
+        response.raise_for_status()
+        data = response.json()
+        try:
+            cache.set(key, data, timeout=300)
+        except redis.RedisError:
+            pass  # Fetched live again next time
+    return data
+
 @app.route('/convert_currency', methods=['POST'])
 @login_required
 @user_required
@@ -755,9 +1134,7 @@ def convert_currency():
     from_currency = request.form.get('from_currency')
     to_currency = request.form.get('to_currency')
 
-    # Example: Real-time currency conversion using an API
-    response = requests.get(f'https://api.exchangerate-api.com/v4/latest/{from_currency}')
-    data = response.json()
+    data = exchange_rates(from_currency)
     converted_amount = float(amount) * data['rates'][to_currency]
 
     return jsonify({'converted_amount': converted_amount})
@@ -773,7 +1150,7 @@ def upload_profile_picture():
     if form.validate_on_submit():
         filename = photos.save(form.photo.data)
         current_user.profile_picture = filename
-        db.session.commit()
+        resize_profile_picture_task.delay(photos.path(filename))
         log_activity(current_user.id, 'Uploaded profile picture')
         flash('Profile picture has been uploaded!', 'success')
         return redirect(url_for('profile'))
@@ -797,8 +1174,16 @@ def voice_commands():
 def mobile_api():
     """
     Mobile API endpoint for integrating with the mobile app.
-    """
-    data = request.json
+    Accepts JSON, or MessagePack sent as application/msgpack, which is
+    smaller on the wire and faster to decode.
+    """
+    if request.mimetype == 'application/msgpack':
+        try:
+            data = msgpack.unpackb(request.get_data(cache=False), raw=False)
+        except (ValueError, TypeError, msgpack.UnpackException):
+            abort(400)
+    else:
+        data = request.json
     # Logic to handle data from the mobile app
     process_mobile_data(data)
     return jsonify({'status': 'success'})
@@ -1,28 +1,72 @@
 # app/socketio_events.py
 
-from app import socketio
+import threading
+from collections import deque
+from app import app, socketio
 from flask_socketio import emit
 from flask_login import current_user
 
+# Notifications are queued and broadcast together, so a burst costs each client
+# a few 'batch' frames of [{'event': ..., 'data': ...}, ...] instead of one per message
+NOTIFICATION_FLUSH_INTERVAL = 0.01
+NOTIFICATION_BATCH_SIZE = 128
+# Oldest notifications are dropped past this many, so a stalled flusher cannot grow memory
+NOTIFICATION_QUEUE_LIMIT = 10000
+_pending = deque(maxlen=NOTIFICATION_QUEUE_LIMIT)
+_flusher_started = False
+_flusher_lock = threading.Lock()
+
+def _flush_notifications():
+    """
+    Broadcast queued notifications in order, up to NOTIFICATION_BATCH_SIZE per frame.
+    A failed emit is logged and its batch dropped, so the flusher keeps running.
+    """
+    while True:
+        socketio.sleep(NOTIFICATION_FLUSH_INTERVAL)
+        while _pending:
+            batch = []
+            while _pending and len(batch) < NOTIFICATION_BATCH_SIZE:
+                batch.append(_pending.popleft())
+            try:
+                socketio.emit('batch', batch)
+            except Exception:
+                app.logger.exception('Failed to broadcast %d notifications', len(batch))
+            # Let handlers receive between large fan-outs
+            socketio.sleep(0)
+
+def _queue_broadcast(event, data):
+    """
+    Queue a broadcast, starting the flusher in this process on first use.
+    """
+    global _flusher_started
+    _pending.append({'event': event, 'data': data})
+    if not _flusher_started:
+        with _flusher_lock:
+            if not _flusher_started:
+                socketio.start_background_task(_flush_notifications)
+                _flusher_started = True
+
 @socketio.on('connect')
 def handle_connect():
     """
     Handle user connection.
     """
-    if current_user.is_authenticated:
-        emit('message', {'data': f'User {current_user.username} connected'})
+    user = current_user._get_current_object()  # Resolve the proxy once
+    if user.is_authenticated:
+        emit('message', {'data': f'User {user.username} connected'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """
     Handle user disconnection.
     """
-    if current_user.is_authenticated:
-        emit('message', {'data': f'User {current_user.username} disconnected'})
+    user = current_user._get_current_object()  # Resolve the proxy once
+    if user.is_authenticated:
+        emit('message', {'data': f'User {user.username} disconnected'})
 
 @socketio.on('notification')
 def handle_notification(data):
     """
     Handle sending notifications to users.
     """
-    emit('notification', {'data': data}, broadcast=True)
+    _queue_broadcast('notification', {'data': data})
@@ -73,6 +73,29 @@ function initializeTooltips() {
     });
 }
 
+// Function to show real-time notifications. The server batches broadcasts
+// into 'batch' frames of [{event, data}, ...]; each entry is handled as if
+// it had arrived as its own event
+function handleSocketNotifications() {
+    if (typeof io === 'undefined') {
+        return; // Socket.IO client not loaded on this page
+    }
+    const handlers = {
+        notification: function (payload) {
+            showNotification(payload.data, 'info');
+        }
+    };
+    const socket = io();
+    socket.on('batch', function (events) {
+        events.forEach(function (item) {
+            const handler = handlers[item.event];
+            if (handler) {
+                handler(item.data);
+            }
+        });
+    });
+}
+
 // Document ready event listener
 document.addEventListener("DOMContentLoaded", function () {
     console.log("JavaScript is loaded and ready.");
@@ -82,4 +105,5 @@ document.addEventListener("DOMContentLoaded", function () {
     handleTransactionForm();
     handleProfileUpdate();
     initializeTooltips();
+    handleSocketNotifications();
 });
@@ -0,0 +1,89 @@
+# app/tasks.py
+
+"""
+Scheduled background jobs run by APScheduler.
+
+Jobs:
+    - refresh_oauth_tokens: Renews OAuth access tokens shortly before they expire,
+      so request handlers never block on a token refresh round-trip.
+
+Jobs are only registered when the scheduler is enabled (ENABLE_SCHEDULER).
+"""
+
+from datetime import datetime, timedelta
+import redis
+import requests
+from sqlalchemy.orm import undefer_group
+from app import app, db, scheduler, google, facebook, redis_client, http_session
+from app.models import User
+
+OAUTH_PROVIDERS = {'google': google, 'facebook': facebook}
+OAUTH_REFRESH_MARGIN = timedelta(minutes=5)
+
+def oauth_cache_key(provider, user_id):
+    """
+    Redis key holding a user's current access token for a provider.
+    """
+    return f'oauth:{provider}:{user_id}'
+
+def get_cached_oauth_token(provider, user_id):
+    """
+    The access token cached by store_oauth_token, or None if there is none
+    or Redis is unavailable (callers then fall back to the session's copy).
+    """
+    try:
+        token = redis_client.get(oauth_cache_key(provider, user_id))
+    except redis.RedisError:
+        return None
+    return token.decode() if token is not None else None
+
+def store_oauth_token(user, provider, response):
+    """
+    Save an OAuth token response on the user and cache the access token.
+    """
+    user.oauth_provider = provider
+    user.oauth_access_token = response['access_token']
+    if response.get('refresh_token'):
+        user.oauth_refresh_token = response['refresh_token']
+    expires_in = int(response.get('expires_in') or 3600)
+    user.oauth_expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
+    # Expire the cached copy a minute early so callers never read a stale token
+    if expires_in > 60:
+        try:
+            redis_client.setex(oauth_cache_key(provider, user.id), expires_in - 60, user.oauth_access_token)
+        except redis.RedisError:
+            app.logger.warning('Could not cache the %s token for user %s', provider, user.id)
+
+def refresh_oauth_tokens():
+    """
+    Refresh every OAuth token that expires within OAUTH_REFRESH_MARGIN.
+    """
+    with app.app_context():
+        due = User.query.options(undefer_group('secrets')).filter(
+            User.oauth_refresh_token.isnot(None),
+            User.oauth_expires_at < datetime.utcnow() + OAUTH_REFRESH_MARGIN
+        ).all()
+        for user in due:
+            remote = OAUTH_PROVIDERS[user.oauth_provider]
+            # One user's failure must not undo the refreshes before it in this run
+            try:
+                response = http_session.post(remote.expand_url(remote.access_token_url), data={
+                    'grant_type': 'refresh_token',
+                    'refresh_token': user.oauth_refresh_token,
+                    'client_id': remote.consumer_key,
+                    'client_secret': remote.consumer_secret
+                }, timeout=10)
+                if 400 <= response.status_code < 500 and response.status_code != 429:
+                    # Revoked or rejected grant: stop retrying until the user logs in again
+                    app.logger.warning('OAuth refresh rejected for user %s: %s', user.id, response.status_code)
+                    user.oauth_refresh_token = None
+                    continue
+                response.raise_for_status()
+                store_oauth_token(user, user.oauth_provider, response.json())
+            except (requests.RequestException, ValueError, KeyError) as exc:
+                # Transient failure or malformed reply; retried on the next run
+                app.logger.warning('OAuth refresh failed for user %s: %s', user.id, exc)
+        db.session.commit()
+
+if scheduler is not None:
+    scheduler.add_job(id='oauth_refresh', func=refresh_oauth_tokens, trigger='interval', minutes=1)
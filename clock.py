@@ -0,0 +1,15 @@
+# clock.py
+
+# Runs the scheduled jobs (see app/tasks.py) in one dedicated process, so each
+# job fires once however many web and Celery workers are running.
+# Run with: python clock.py
+import time
+from app import scheduler, start_scheduler
+
+if __name__ == "__main__":
+    if scheduler is None:
+        raise SystemExit('The scheduler is disabled (ENABLE_SCHEDULER is off).')
+    start_scheduler()
+    # The scheduler runs in a background thread; keep the process alive
+    while True:
+        time.sleep(60)
@@ -1,12 +1,23 @@
 # config.py
 
 import os
+from datetime import timedelta
 basedir = os.path.abspath(os.path.dirname(__file__))
+# Set FLASK_SKIP_OPTIONAL (e.g. for `flask db ...`) to leave out the optional extensions
+skip_optional = os.environ.get('FLASK_SKIP_OPTIONAL') is not None
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Keep pooled connections validated and recycled before the server drops them
+    SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': True, 'pool_recycle': 1800}
+    if not SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+        # SQLite uses a NullPool/StaticPool, which do not accept sizing arguments
+        SQLALCHEMY_ENGINE_OPTIONS.update(pool_size=10, max_overflow=20, pool_timeout=30)
+    SQLALCHEMY_WARM_POOL = os.environ.get('SQLALCHEMY_WARM_POOL') is not None
+    # Queries slower than this many seconds are logged as warnings
+    SLOW_QUERY_THRESHOLD = float(os.environ.get('SLOW_QUERY_THRESHOLD') or 0.1)
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
@@ -14,13 +25,57 @@ class Config:
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     ADMINS = ['your-email@example.com']
     UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
+    # Let the front-end server stream uploads: X-Sendfile (Apache/lighttpd) or an
+    # nginx internal location prefix for X-Accel-Redirect, e.g. '/_protected/'
+    USE_X_SENDFILE = os.environ.get('USE_X_SENDFILE') is not None
+    UPLOADS_ACCEL_REDIRECT_PREFIX = os.environ.get('UPLOADS_ACCEL_REDIRECT_PREFIX')
+    # Reject oversized request bodies before they are read
+    MAX_CONTENT_LENGTH = 50 * 1024 * 1024
     BACKUP_FOLDER = os.path.join(basedir, 'backups')
     EXPORT_FOLDER = os.path.join(basedir, 'exports')
     SECURITY_PASSWORD_SALT = 'my_precious_two'
+    # argon2id password hashing costs (benchmark on the target hardware)
+    ARGON2_TIME_COST = int(os.environ.get('ARGON2_TIME_COST') or 2)
+    ARGON2_MEMORY_COST = int(os.environ.get('ARGON2_MEMORY_COST') or 65536)
+    ARGON2_PARALLELISM = int(os.environ.get('ARGON2_PARALLELISM') or 2)
+    # Server-side sessions: the cookie only carries a signed session id
+    SESSION_TYPE = os.environ.get('SESSION_TYPE') or 'redis'
+    SESSION_USE_SIGNER = True
+    SESSION_KEY_PREFIX = 'sess:'
+    # Only used with SESSION_TYPE=filesystem (e.g. in the tests)
+    SESSION_FILE_DIR = os.environ.get('SESSION_FILE_DIR') or os.path.join(basedir, 'flask_session')
+    # Sessions are stamped permanent on creation and expire after 30 minutes
+    SESSION_PERMANENT = True
+    PERMANENT_SESSION_LIFETIME = timedelta(minutes=30)
     GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
     GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
     FACEBOOK_CLIENT_ID = os.environ.get('FACEBOOK_CLIENT_ID')
     FACEBOOK_CLIENT_SECRET = os.environ.get('FACEBOOK_CLIENT_SECRET')
+    CORS_ORIGIN = os.environ.get('CORS_ORIGIN') or '*'
     SCHEDULER_API_ENABLED = True
+    # Set by gunicorn.conf.py so background threads start in each worker after fork
+    DEFER_BACKGROUND_START = os.environ.get('DEFER_BACKGROUND_START') is not None
+    ENABLE_SCHEDULER = not skip_optional
+    # Start scheduled jobs at import; set in one process only (clock.py starts them itself)
+    RUN_SCHEDULER = os.environ.get('RUN_SCHEDULER') is not None
+    ENABLE_SOCKETIO = not skip_optional
+    ENABLE_GRAPHQL = not skip_optional
+    ENABLE_API_DOCS = not skip_optional
     SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or 'redis://'
+    REDIS_URL = os.environ.get('REDIS_URL') or 'redis://localhost:6379/0'
+    # Seconds before a Redis call gives up, so a stalled Redis cannot hang requests
+    REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT') or 1)
+    CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL') or REDIS_URL
+    # Run tasks inline instead of queueing them (tests, or no worker running)
+    CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER') is not None
+    RATELIMIT_STORAGE_URL = os.environ.get('RATELIMIT_STORAGE_URL') or REDIS_URL
+    RATELIMIT_STRATEGY = 'moving-window'
+    RATELIMIT_STORAGE_OPTIONS = {'max_connections': 20}
+    RATELIMIT_SWALLOW_ERRORS = True
+    # Failed logins per username before the account is locked for LOGIN_LOCKOUT_SECONDS
+    LOGIN_MAX_FAILURES = int(os.environ.get('LOGIN_MAX_FAILURES') or 10)
+    LOGIN_LOCKOUT_SECONDS = int(os.environ.get('LOGIN_LOCKOUT_SECONDS') or 900)
+    CACHE_TYPE = os.environ.get('CACHE_TYPE') or 'RedisCache'
+    CACHE_REDIS_URL = REDIS_URL
+    CACHE_DEFAULT_TIMEOUT = 60
     # Additional configurations if needed
@@ -0,0 +1,39 @@
+# gunicorn.conf.py
+
+# Run with: gunicorn -c gunicorn.conf.py -w 4 app:app
+import os
+
+# Set GUNICORN_WORKER_CLASS=gevent to serve many concurrent I/O-bound requests
+# per worker; each gevent worker multiplexes up to worker_connections of them.
+# For Socket.IO over WebSockets use
+# geventwebsocket.gunicorn.workers.GeventWebSocketWorker (with -w 1, or a
+# SOCKETIO_MESSAGE_QUEUE and sticky sessions for more workers).
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS') or 'sync'
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS') or 1000)
+
+if worker_class.startswith('gevent'):
+    # With preload_app the app is imported in the master, before gunicorn's
+    # gevent worker would patch, so patch here while nothing is imported yet
+    from gevent import monkey
+    monkey.patch_all()
+
+# Raise the open-file limit before workers are forked, so they inherit it
+from resource_limits import raise_open_file_limit
+raise_open_file_limit()
+
+# Import the app once in the master so workers share its pages copy-on-write
+preload_app = True
+bind = '0.0.0.0:5000'
+
+# Background threads started before fork would only live in the master
+os.environ.setdefault('DEFER_BACKGROUND_START', '1')
+
+def post_fork(server, worker):
+    """
+    Start the activity log writer inside each forked worker. Scheduled
+    jobs run in the separate clock process, not in web workers.
+    """
+    from app import db, start_background_services
+    # Connections pooled in the master belong to it; never share their sockets
+    db.engine.dispose(close=False)
+    start_background_services()
@@ -0,0 +1,15 @@
+# resource_limits.py
+
+# Imported by gunicorn.conf.py and run.py before the app, so it must not import it
+
+def raise_open_file_limit():
+    """
+    Lift the soft open-file limit (often 1024) to the hard limit, so each
+    long-lived WebSocket does not count against a low ceiling.
+    """
+    try:
+        import resource
+        _soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass  # Not POSIX, or the limit cannot be raised here
@@ -1,8 +1,20 @@
 # run.py
 
+if __name__ == "__main__":
+    # Patch before the app (and its sockets, Redis and database drivers) is
+    # imported, so the dev server and Socket.IO share one cooperative loop
+    from gevent import monkey
+    monkey.patch_all()
+
 # Import the application instance from the app package
-from app import app
+from app import app, socketio
 
 # Main entry point for the Flask application
 if __name__ == "__main__":
-    app.run(debug=True)  # Run the application in debug mode
\ No newline at end of file
+    from resource_limits import raise_open_file_limit
+    raise_open_file_limit()
+    if socketio is not None:
+        # Serves HTTP and WebSockets from gevent instead of Werkzeug's threaded dev server
+        socketio.run(app, debug=True)
+    else:
+        app.run(debug=True)  # Run the application in debug mode
@@ -1,23 +1,92 @@
+import os
+import tempfile
+
+# Configure the app before it is imported: sessions, the cache and rate limits
+# stay in-process instead of needing a live Redis, and no background thread
+# shares the test's database connection
+os.environ['SESSION_TYPE'] = 'filesystem'
+os.environ['SESSION_FILE_DIR'] = tempfile.mkdtemp(prefix='pfms-test-sessions-')
+os.environ['CACHE_TYPE'] = 'SimpleCache'
+os.environ['RATELIMIT_STORAGE_URL'] = 'memory://'
+os.environ['DEFER_BACKGROUND_START'] = '1'
+
+import fakeredis
 import pytest
-from app import app, db
+from sqlalchemy.pool import StaticPool
+from app import app, db, celery, cache, limiter, user_permission
+from app import activity_logger, routes, tasks
 from app.models import User
 
-@pytest.fixture
-def client():
+@pytest.fixture(scope='session')
+def database():
+    """
+    Create the in-memory schema once for the whole test session.
+    """
     app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-    
+    app.config['WTF_CSRF_ENABLED'] = False  # Tests post forms without a CSRF token
+    # A named in-memory database per pytest-xdist worker ('master' when run serially)
+    worker = os.environ.get('PYTEST_XDIST_WORKER', 'master')
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///file:memdb_{worker}?mode=memory&cache=shared&uri=true'
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'poolclass': StaticPool,
+        'connect_args': {'check_same_thread': False}
+    }
+    celery.conf.task_always_eager = True
+    limiter.enabled = False
+
+    with app.app_context():
+        db.create_all()
+    yield db
+
+    with app.app_context():
+        db.drop_all()
+
+@pytest.fixture
+def client(database, monkeypatch):
+    """
+    Set up the test client for Flask application. Each test gets a fresh
+    in-memory Redis for login lockouts and OAuth tokens. Rows written by the
+    test are deleted afterwards, and the cache is cleared so no cached user
+    outlives its row; emptying the tables is much cheaper than dropping and
+    recreating the schema for every test.
+    """
+    fake_redis = fakeredis.FakeStrictRedis()
+    monkeypatch.setattr(routes, 'redis_client', fake_redis)
+    monkeypatch.setattr(tasks, 'redis_client', fake_redis)
+
     with app.test_client() as client:
-        with app.app_context():
-            db.create_all()
         yield client
 
+    # Without the writer thread, queued activity entries are written here
+    activity_logger.flush_pending()
     with app.app_context():
-        db.drop_all()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+    cache.clear()
 
 @pytest.fixture
 def init_database():
+    """
+    Initialize the database with a test user.
+    """
     user = User(username='testuser', email='test@example.com')
     user.set_password('password')
     db.session.add(user)
     db.session.commit()
+
+@pytest.fixture
+def logged_in_user(client, monkeypatch):
+    """
+    Create a verified user and log them in. Nothing assigns roles in the
+    app yet, so the 'user' permission is granted directly.
+    """
+    user = User(username='verified', email='verified@example.com', email_verified=True)
+    user.set_password('password')
+    db.session.add(user)
+    db.session.commit()
+    # Load the row now: the login request ends this session and detaches the user
+    db.session.refresh(user)
+    monkeypatch.setattr(user_permission, 'can', lambda: True)
+    client.post('/login', data=dict(username='verified', password='password'))
+    return user